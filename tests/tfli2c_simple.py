@@ -19,14 +19,30 @@
 #
 =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
 
-import time  # Needed for 'sleep' function
+import asyncio  # Needed for the sample loop
 import sys
 import tfli2c as tfl  # Import `tfli2c` module v0.0.1
 
+try:
+    import uvloop  # Optional faster event loop, v0.18 or later
+    run = uvloop.run
+except (ImportError, AttributeError):  # no uvloop.run before v0.18
+    run = asyncio.run
+
 #   - - -  Set I2C Port and Address numbers  - - - - - - - -
 i2c_addr = 0x10  # Device address in Hex, Decimal 16
 i2c_port = 1  # I2C(1), /dev/i2c-1, GPIO 2/3, pins 3/5
 
+#  - - -  Switch to real-time scheduling on CPU 3  - - -
+#  Reduces loop jitter. Needs root, e.g. `sudo python3 ...`,
+#  and works best with `isolcpus=3 nohz_full=3` added to
+#  '/boot/cmdline.txt'. The loop still runs without it.
+try:
+    tfl.enable_realtime(cpu=3, priority=50)
+    print("Real-time: enabled")
+except OSError:
+    print("Real-time: not available")
+
 #  - - -  Initalize module and device - - -
 try:
     connexion1 = tfl.Lidar(i2c_addr, i2c_port)
@@ -35,26 +51,42 @@ except OSError:
     print("Not ready")
     sys.exit()  # quit the program if not ready
 
+
+#  - - - -  Sample loop, run as an asyncio task  - - - - -
+#  Each pass sleeps until an absolute 50ms deadline on the
+#  event loop's monotonic clock for a 20Hz loop-rate, so
+#  timing errors do not accumulate.  Names used in the loop
+#  are bound to locals once, up front.
+async def pump():
+    loop = asyncio.get_running_loop()
+    lidar = connexion1
+    get_data = lidar.get_data
+    sleep = asyncio.sleep
+    _print = print
+    deadline = loop.time()
+    while True:
+        deadline += 0.05
+        await sleep(deadline - loop.time())
+        get_data()  # Get tfl data
+        _print(lidar.dist)  # display distance
+
+
 #  - - - -  Loop until an exception occurs  - - - - -
-while True:
-    try:
-        time.sleep(0.05)  # Delay 50ms for 20Hz loop-rate
-        connexion1.get_data()  # Get tfl data
-        print(connexion1.dist)  # display distance
-    #
-    #  Use control-C to break loop
-    except KeyboardInterrupt:
-        print('Keyboard Interrupt')
-        break
-    #
-    '''
-    #  Catch all other exceptions
-    except Exception:
-        eType = sys.exc_info()[0]  # Return exception type
-        print(eType)
-        break
-    '''
+try:
+    run(pump())
+#
+#  Use control-C to break loop
+except KeyboardInterrupt:
+    print('Keyboard Interrupt')
+#
+'''
+#  Catch all other exceptions
+except Exception:
+    eType = sys.exc_info()[0]  # Return exception type
+    print(eType)
+'''
 #
+connexion1.close()  # Close I2C communication
 print("That's all folks!")  # Say "Goodbye!"
 sys.exit()  # Clean up the OS and exit.
 #
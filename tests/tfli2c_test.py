@@ -46,18 +46,35 @@
 # Press Ctrl-C to break the loop
 #
 # 'tmli2c' does not work in Windows because required
-# 'smbus' module only works in Linux/Raspian/MacOS
+# 'smbus2' module only works in Linux/Raspian/MacOS
 =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 """
 
+import asyncio
 import time
 import sys
 import tfli2c as tfl    # Import `tfli2c` module v0.0.1
 
+try:
+    import uvloop       # Optional faster event loop, v0.18 or later
+    run = uvloop.run
+except (ImportError, AttributeError):  # no uvloop.run before v0.18
+    run = asyncio.run
+
 # I2CPort = 0     # I2C(0), /dev/i2c-0, GPIO 0/1, pins 27/28
 i2c_port = 1      # I2C(4), /dev/i2c-4, GPIO 8/9, pins 24/21
 i2c_addr = 0x10   # Device address in Hex, Decimal 16
 
+#  - - -  Switch to real-time scheduling on CPU 3  - - -
+#  Reduces loop jitter. Needs root, e.g. `sudo python3 ...`,
+#  and works best with `isolcpus=3 nohz_full=3` added to
+#  '/boot/cmdline.txt'. The loop still runs without it.
+try:
+    tfl.enable_realtime(cpu=3, priority=50)
+    print("Real-time: enabled")
+except OSError:
+    print("Real-time: not available")
+
 # - - - -  Set and Test I2C communication  - - - -
 #  This function is needed to set the I2C port and
 #  address values, and to test those settings.
@@ -108,28 +125,47 @@ time.sleep(0.5)     # Wait half a second.
 #  If system error, wait two seconds and restart.
 #  Quit after third attempt.
 tfAttempt = 0
+
+
+#  The sample loop runs as an asyncio task.  Each pass
+#  sleeps until an absolute 50ms deadline on the event loop's
+#  monotonic clock for a 20Hz loop-rate, so timing errors do
+#  not accumulate.  Names used in the loop are bound to
+#  locals once, up front.
+async def pump():
+    loop = asyncio.get_running_loop()
+    lidar = connexion1
+    get_data = lidar.get_data
+    print_status = lidar.print_status
+    sleep = asyncio.sleep
+    _print = print
+    deadline = loop.time()
+    #  Loop until exception occurs
+    while True:
+        deadline += 0.05
+        await sleep(deadline - loop.time())
+        #  - - - - - - - - - - - - - - - - - - - - - - - - -
+        #  This line of code:
+        #      print( f"{value:0{padding}}", end = '')
+        #  formats 'value' as a decimal number padded with 0s
+        #  to the length of 'padding' and no CR/LF at the end.
+        #  - - - - - - - - - - - - - - - - - - - - - - - - -
+        #  Display three main data values from the device.
+        if get_data():
+            # Display distance in centimeters,
+            _print(f"Dist:{lidar.dist:{4}}cm", end=" | ")
+            # display signal-strength or quality,
+            _print(f"Flux:{lidar.flux:{6}d}", end=" | ")
+            # and display temperature in Centigrade.
+            _print(f"Temp:{lidar.temp:{3}}°C")
+        else:                  # If the command fails...
+            print_status()     # display the error status
+
+
 #
 while tfAttempt < 3:
     try:
-        #  Loop until exception occurs
-        while True:
-            time.sleep(0.047)   # Add 47ms delay for 20Hz loop-rate
-            #  - - - - - - - - - - - - - - - - - - - - - - - - -
-            #  This line of code:
-            #      print( f"{value:0{padding}}", end = '')
-            #  formats 'value' as a decimal number padded with 0s
-            #  to the length of 'padding' and no CR/LF at the end.
-            #  - - - - - - - - - - - - - - - - - - - - - - - - -
-            #  Display three main data values from the device.
-            if connexion1.get_data():
-                # Display distance in centimeters,
-                print(f"Dist:{connexion1.dist:{4}}cm", end=" | ")
-                # display signal-strength or quality,
-                print(f"Flux:{connexion1.flux:{6}d}", end=" | ")
-                # and display temperature in Centigrade.
-                print(f"Temp:{connexion1.temp:{3}}°C")
-            else:                  # If the command fails...
-                connexion1.print_status()  # display the error status
+        run(pump())
     #
     #  Use control-C to break loop.
     except KeyboardInterrupt:
@@ -144,6 +180,7 @@ while tfAttempt < 3:
         print("Attempts: " + str(tfAttempt))
         time.sleep(2.0)     # Wait two seconds and retry.
 #
+connexion1.close()  # Close I2C communication
 print("That's all folks!")  # Say "Goodbye!"
 sys.exit()                  # Clean up the OS and exit.
 #
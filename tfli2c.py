@@ -33,11 +33,36 @@
  #  the `set` commmands require a follow-on `saveSettings`
  #  and `softReset` commands.
  #
+ #  Requires the `smbus2` module for its `i2c_rdwr()`
+ #  combined transactions.
+ #
 =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 """
 
+import atexit
+import ctypes
+import os
+import struct
 import time
-from smbus import SMBus
+from smbus2 import SMBus, i2c_msg
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by `Lidar.sample_batch()`
+    np = None
+
+try:
+    import tfli2c_fast  # Optional C extension, see 'tfli2c_fast.c'
+except ImportError:
+    tfli2c_fast = None
+
+# Decode a data frame as three little-endian unsigned words:
+# distance, signal strength and temperature
+_UNPACK = struct.Struct('<HHH').unpack_from
+
+# `mlockall()` flags from <sys/mman.h>
+_MCL_CURRENT = 1
+_MCL_FUTURE = 2
 
 
 class Reg:
@@ -93,6 +118,46 @@ class Reg:
     TFL_INVALID = 14  # Invalid operation sent to sendCommand()
 
 
+# - -   Status code display strings used by `print_status()`  - -
+_STATUS_STR = {
+    Reg.TFL_READY: "READY",
+    Reg.TFL_SERIAL: "SERIAL",
+    Reg.TFL_HEADER: "HEADER",
+    Reg.TFL_CHECKSUM: "CHECKSUM",
+    Reg.TFL_TIMEOUT: "TIMEOUT",
+    Reg.TFL_PASS: "PASS",
+    Reg.TFL_FAIL: "FAIL",
+    Reg.TFL_I2CREAD: "I2C-READ",
+    Reg.TFL_I2CWRITE: "I2C-WRITE",
+    Reg.TFL_I2CLENGTH: "I2C-LENGTH",
+    Reg.TFL_WEAK: "Signal weak",
+    Reg.TFL_STRONG: "Signal saturation",
+    Reg.TFL_FLOOD: "Ambient light saturation",
+}
+
+
+# Status codes set on every call to `get_data()`
+_STATUS_READY = Reg.TFL_READY
+_STATUS_WEAK = Reg.TFL_WEAK
+_STATUS_STRONG = Reg.TFL_STRONG
+_STATUS_FLOOD = Reg.TFL_FLOOD
+
+# Module-level copies of the registers used by `Lidar` methods,
+# one global lookup each instead of a global plus an attribute
+_DIST_LO = Reg.TFL_DIST_LO
+_TICK_LO = Reg.TFL_TICK_LO
+_VER_REV = Reg.TFL_VER_REV
+_PROD_CODE = Reg.TFL_PROD_CODE
+_SAVE_SETTINGS = Reg.TFL_SAVE_SETTINGS
+_SOFT_RESET = Reg.TFL_SOFT_RESET
+_HARD_RESET = Reg.TFL_HARD_RESET
+_SET_I2C_ADDR = Reg.TFL_SET_I2C_ADDR
+_SET_MODE = Reg.TFL_SET_MODE
+_TRIGGER = Reg.TFL_TRIGGER
+_DISABLE = Reg.TFL_DISABLE
+_FPS_LO = Reg.TFL_FPS_LO
+
+
 class Lidar:
 
     status = 0  # error status code
@@ -104,6 +169,10 @@ class Lidar:
     TFL_MAX_READS = 20  # readData() sets SERIAL error
     MAX_BYTES_BEFORE_HEADER = 20  # getData() sets HEADER error
     MAX_ATTEMPTS_TO_MEASURE = 20
+    TFL_SAMPLE_TIME = 0.01  # seconds for one triggered sample
+
+    _triggered = False  # get_data_pipelined() has a sample pending
+    _fast = None  # `tfli2c_fast.Sampler`, if the extension is built
 
     tflAddr = 0x10  # TFLuna I2C device address
     # Range: 0x08 to 0x77
@@ -114,12 +183,53 @@ class Lidar:
     def __init__(self, addr, port):
         self.tflAddr = addr  # re-assign device address
         self.tflPort = port  # re-assign port number
-        bus = SMBus(self.tflPort)
-        bus.open(self.tflPort)  # Open I2C communication
-        bus.write_quick(self.tflAddr)  # Short test transaction
-        # Set device to single-shot/trigger mode
-        bus.write_byte_data(self.tflAddr, Reg.TFL_SET_MODE, 1)
-        bus.close()  # Close I2C communication
+        # Build the data frame messages once.  The kernel reads
+        # each frame straight into `_frame`, so no new objects
+        # are made per sample.
+        self._frame = bytearray(6)
+        self._trigger_msg = i2c_msg.write(self.tflAddr, [_TRIGGER, 1])
+        self._point_msg = i2c_msg.write(self.tflAddr, [_DIST_LO])
+        self._read_msg = i2c_msg.read(self.tflAddr, 6)
+        self._read_msg.buf = (ctypes.c_char * 6).from_buffer(self._frame)
+        # Commands with constant payloads are also built once
+        self._mode_cont_msg = i2c_msg.write(self.tflAddr, [_SET_MODE, 0])
+        self._mode_trig_msg = i2c_msg.write(self.tflAddr, [_SET_MODE, 1])
+        self._fps_msgs = {}  # frame rate messages, built on first use
+        # Open I2C communication once and keep it open for the
+        # life of the instance rather than once per command
+        self._bus = SMBus(self.tflPort)
+        atexit.register(self._bus.close)
+        try:
+            self._bus.write_quick(self.tflAddr)  # Short test transaction
+            # Set device to single-shot/trigger mode
+            self._bus.i2c_rdwr(self._mode_trig_msg)
+        except OSError:
+            self.close()  # Don't leave the bus open if not ready
+            raise
+        # Use the C fast path for `get_data()` when available
+        if tfli2c_fast is not None:
+            try:
+                self._fast = tfli2c_fast.Sampler(self.tflPort, self.tflAddr)
+            except OSError:
+                self.close()  # Don't leave the bus open on failure
+                raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        - - - - -    CLOSE I2C COMMUNICATION   - - - - -
+        """
+        self._bus.close()
+        atexit.unregister(self._bus.close)
+        self._triggered = False
+        if self._fast is not None:
+            self._fast.close()
+            self._fast = None  # Fail through smbus2 like other methods
 
     def get_data(self):
         """
@@ -132,61 +242,149 @@ class Lidar:
         ''' Get get three data values '''
 
         #  2. Get data from the device.
-        bus = SMBus(self.tflPort)  # Open I2C communication
-        # Trigger a one-shot data sample
-        bus.write_byte_data(self.tflAddr, Reg.TFL_TRIGGER, 1)
-        #  Read the first six registers
-        frame = bus.read_i2c_block_data(self.tflAddr, 0, 6)
-        bus.close()  # Close I2C communication
-
-        #  3. Shift data from read array into the three variables
-        self.dist = frame[0] + (frame[1] << 8)
-        self.flux = frame[2] + (frame[3] << 8)
-        self.temp = frame[4] + (frame[5] << 8)
+        #  Use the C extension when it is available.
+        if self._fast is not None:
+            self.dist, self.flux, self.temp = self._fast.read()
+            return self._check_data()
+        #  Trigger a one-shot data sample, point back at the first
+        #  register and read six bytes, all in a single I2C_RDWR
+        #  ioctl joined by repeated-STARTs instead of three
+        #  separate transactions with idle gaps in between.
+        self._bus.i2c_rdwr(self._trigger_msg, self._point_msg, self._read_msg)
+        return self._parse_frame(self._frame)
+
+    def get_data_pipelined(self):
+        """
+        - - - - - - - - - - - - - - - - - - - - - - - - - -
+                GET PIPELINED DATA FROM THE DEVICE
+        - - - - - - - - - - - - - - - - - - - - - - - - - -
+        Read the sample triggered by the previous call and
+        trigger the next one in the same I2C transaction, so
+        the device measures while the caller waits between
+        calls.  The first call also triggers and waits first.
+        Return `True`/`False` as for `get_data()`
+        """
+        if not self._triggered:
+            self._trigger()
+            time.sleep(self.TFL_SAMPLE_TIME)
+        #  Read this frame, then start the next sample
+        self._bus.i2c_rdwr(self._point_msg, self._read_msg, self._trigger_msg)
+        self._triggered = True
+        return self._parse_frame(self._frame)
+
+    def sample_batch(self, n, period=None):
+        """
+        - - - - - - - - - - - - - - - - - - - - - - - - - -
+                 GET A BATCH OF SAMPLES AS AN ARRAY
+        - - - - - - - - - - - - - - - - - - - - - - - - - -
+        Take `n` samples, `period` seconds apart, and return
+        them as an (n, 3) numpy array of unsigned 16-bit words
+        with columns dist, flux and temp (in 0.01 degrees C).
+        `period` defaults to `TFL_SAMPLE_TIME`.  Rows sampled
+        faster than the device can measure repeat the
+        previous frame.
+        Frames are copied straight into the array, so no
+        Python objects are made per sample.  Data values are
+        not evaluated and `status` is not set.
+        Requires the `numpy` module.
+        """
+        if np is None:
+            raise ImportError("sample_batch() requires numpy")
+        if period is None:
+            period = self.TFL_SAMPLE_TIME
+        out = np.empty((n, 3), dtype='<u2')
+        addr = out.ctypes.data
+        trigger = self._trigger_msg
+        point = self._point_msg
+        read = self._read_msg
+        rdwr = self._bus.i2c_rdwr
+        sleep = time.sleep
+        perf_counter = time.perf_counter
+        next_t = perf_counter()
+        for i in range(n):
+            rdwr(trigger, point, read)
+            ctypes.memmove(addr + 6 * i, read.buf, 6)
+            if period:
+                next_t += period
+                sleep(max(0, next_t - perf_counter()))
+        return out
+
+    def _trigger(self):
+        """Trigger a one-shot data sample"""
+        self._bus.i2c_rdwr(self._trigger_msg)
+
+    def _parse_frame(self, frame):
+        """
+        Set `dist`, `flux`, `temp` and `status` from a data
+        frame and return `True` if no error was found
+        """
+        #  3. Unpack data from read frame into the three variables
+        self.dist, self.flux, temp = _UNPACK(frame)
         # Convert temp to degrees from hundredths
-        self.temp = (self.temp / 100)
+        self.temp = temp / 100
         # Convert Celsius to Fahrenheit
         # temp = ( temp * 9 / 5) + 32
+        return self._check_data()
 
+    def _check_data(self):
+        """
+        Set `status` from the data values and return
+        `True` if no error was found
+        """
         #  4.  Evaluate Abnormal Data Values
-        if self.dist == -1:
-            self.status = Reg.TFL_WEAK
+        #  `dist` is unsigned and can never be -1, so weak
+        #  signal is detected from `flux` alone.  Saturation
+        #  must be tested before the wider ambient light range.
+        flux = self.flux
+        if flux < 100:  # Signal strength < 100
+            self.status = _STATUS_WEAK
             return False
-        elif self.flux < 100:  # Signal strength < 100
-            self.status = Reg.TFL_WEAK
+        elif flux == 0xFFFF:  # Signal saturation
+            self.status = _STATUS_STRONG
             return False
-        elif self.flux > 0x8000:  # Ambient light too strong
-            self.status = Reg.TFL_FLOOD
-            return False
-        elif self.flux == 0xFFFF:  # Signal saturation
-            self.status = Reg.TFL_STRONG
+        elif flux > 0x8000:  # Ambient light too strong
+            self.status = _STATUS_FLOOD
             return False
 
         #  5. Set Ready status and go home
-        self.status = Reg.TFL_READY
+        self.status = _STATUS_READY
         return True
 
     def save_settings(self):
         """
         - - - - -    SAVE SETTINGS   - - - - -
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_SAVE_SETTINGS, 1)
-        bus.close()
+        self._bus.write_byte_data(self.tflAddr, _SAVE_SETTINGS, 1)
 
     def soft_reset(self):
         """- - - -   SOFT RESET aka Reboot  - - - -"""
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_SOFT_RESET, 2)
-        bus.close()
+        self._bus.write_byte_data(self.tflAddr, _SOFT_RESET, 2)
+        self._triggered = False  # Pending sample is lost
 
     def hard_reset(self):
         """
         - - - -   HARD RESET to Factory Defaults  - - - -
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_HARD_RESET, 1)
-        bus.close()
+        self._bus.write_byte_data(self.tflAddr, _HARD_RESET, 1)
+        self._triggered = False  # Pending sample is lost
+
+    def apply_settings(self, *ops):
+        """
+        - - - - -    APPLY SEVERAL SETTINGS   - - - - -
+        Write several registers in one I2C transaction.
+        Each op is a register followed by its data bytes,
+        sent in the order given.  For example:
+            apply_settings((Reg.TFL_FPS_LO, 20, 0),
+                           (Reg.TFL_SAVE_SETTINGS, 1))
+        Saving settings erases flash and can take several
+        hundred milliseconds, so send `soft_reset()` as a
+        separate call after a delay, not in the same batch.
+        """
+        if not ops:
+            raise ValueError("apply_settings() needs at least one op")
+        msgs = [i2c_msg.write(self.tflAddr, list(op)) for op in ops]
+        self._bus.i2c_rdwr(*msgs)
+        self._triggered = False  # Settings may discard a pending sample
 
     def set_i2c_addr(self, addr_new):
         """
@@ -194,9 +392,7 @@ class Lidar:
         Range: 0x08, 0x77.  Must be followed by
         `saveSettings()` and 'softReset()` commands
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_SET_I2C_ADDR, addr_new)
-        bus.close()
+        self._bus.write_byte_data(self.tflAddr, _SET_I2C_ADDR, addr_new)
 
     def set_enable(self):
         """
@@ -204,9 +400,7 @@ class Lidar:
         Turn on LiDAR
         Must be followed by Save and Reset commands
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_DISABLE, 0)
-        bus.close()
+        self._bus.write_byte_data(self.tflAddr, _DISABLE, 0)
 
     def set_disable(self):
         """
@@ -214,9 +408,7 @@ class Lidar:
         Turn off LiDAR
         Must be followed by Save and Reset commands
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_DISABLE, 1)
-        bus.close()
+        self._bus.write_byte_data(self.tflAddr, _DISABLE, 1)
 
     def set_mode_cont(self):
         """
@@ -224,9 +416,8 @@ class Lidar:
         Continuous ranging mode
         Must be followed by Save and Reset commands
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_SET_MODE, 0)
-        bus.close()
+        self._bus.i2c_rdwr(self._mode_cont_msg)
+        self._triggered = False  # Pending sample is lost
 
     def set_mode_trig(self):
         """
@@ -234,18 +425,14 @@ class Lidar:
         Sample range only once when triggered
         Must be followed by Save and Reset commands
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_SET_MODE, 1)
-        bus.close()
+        self._bus.i2c_rdwr(self._mode_trig_msg)
 
     def get_mode(self):
         """
         - - - - - -   GET TRIGGER MODE   - - - - - -
         Return mode type as a string.
         """
-        bus = SMBus(self.tflPort)
-        mode = bus.read_byte_data(self.tflAddr, Reg.TFL_SET_MODE)
-        bus.close()
+        mode = self._bus.read_byte_data(self.tflAddr, _SET_MODE)
         if mode == 0:
             return 'continuous'
         else:
@@ -256,9 +443,7 @@ class Lidar:
         - - - - - -   SET TRIGGER   - - - - - =
         Trigger device to sample one time.
         """
-        bus = SMBus(self.tflPort)
-        bus.write_byte_data(self.tflAddr, Reg.TFL_TRIGGER, 1)
-        bus.close()
+        self._bus.i2c_rdwr(self._trigger_msg)
 
     def set_frame_rate(self, fps):
         """
@@ -267,18 +452,27 @@ class Lidar:
         Command must be followed by `saveSettings()`
         and `softReset()` commands.
         """
-        bus = SMBus(self.tflPort)
-        bus.write_word_data(self.tflAddr, Reg.TFL_FPS_LO, fps)
-        bus.close()
+        self._bus.write_word_data(self.tflAddr, _FPS_LO, fps)
+
+    def set_frame_rate_fast(self, fps):
+        """
+        - - - - -    SET FRAME RATE (cached)   - - - - - -
+        Same as `set_frame_rate()`, but the write message for
+        each `fps` value is built once and reused, for callers
+        that switch between a few fixed rates.
+        """
+        msg = self._fps_msgs.get(fps)
+        if msg is None:
+            msg = i2c_msg.write(self.tflAddr, [_FPS_LO, fps & 0xFF, (fps >> 8) & 0xFF])
+            self._fps_msgs[fps] = msg
+        self._bus.i2c_rdwr(msg)
 
     def get_frame_rate(self):
         """
         - - - - -    GET FRAME RATE   - - - - - -
         Return two-byte Frame Rate (frames per second) value
         """
-        bus = SMBus(self.tflPort)
-        fps = bus.read_word_data(self.tflAddr, Reg.TFL_FPS_LO)
-        bus.close()
+        fps = self._bus.read_word_data(self.tflAddr, _FPS_LO)
         return fps
 
     def get_time(self):
@@ -286,9 +480,7 @@ class Lidar:
         - - - -  GET DEVICE TIME (in milliseconds) - - -
         Return two-byte value of milliseconds since last reset.
         """
-        bus = SMBus(self.tflPort)  # Open I2C communication
-        tim = bus.read_word_data(self.tflAddr, Reg.TFL_TICK_LO)  # Get two bytes of time+
-        bus.close()  # Close I2C communication
+        tim = self._bus.read_word_data(self.tflAddr, _TICK_LO)  # Get two bytes of time+
         return tim
 
     def get_prod_code(self):
@@ -296,26 +488,19 @@ class Lidar:
         - -  GET PRODUCTION CODE (Serial Number) - - -
         Return 14 ascii characters of serial number
         """
-        prod_code = ''
-        bus = SMBus(self.tflPort)  # Open I2C communication
-        for i in range(14):  # Build the 'production code' string
-            prod_code += chr(bus.read_byte_data(self.tflAddr, Reg.TFL_PROD_CODE + i))
-        bus.close()  # Close I2C communication
-        return prod_code
+        #  Read all 14 registers in one block transaction
+        data = self._bus.read_i2c_block_data(self.tflAddr, _PROD_CODE, 14)
+        return bytes(data).decode('latin-1')
 
     def get_firmware_version(self):
         """
         - - - -    GET FIRMWARE VERSION   - - - -
         Return version as a string
         """
-        version = ''
-        bus = SMBus(self.tflPort)  # Open I2C communication
+        #  Read revision, minor and major bytes in one block transaction
+        d = self._bus.read_i2c_block_data(self.tflAddr, _VER_REV, 3)
         #  Build the 'version' string
-        version = \
-            str(bus.read_byte_data(self.tflAddr, Reg.TFL_VER_MAJ)) + '.' + \
-            str(bus.read_byte_data(self.tflAddr, Reg.TFL_VER_MIN)) + '.' + \
-            str(bus.read_byte_data(self.tflAddr, Reg.TFL_VER_REV))
-        bus.close()  # Close I2C communication
+        version = f"{d[2]}.{d[1]}.{d[0]}"
         return version  # Return the version string
 
     def print_status(self):
@@ -328,36 +513,41 @@ class Lidar:
         Print status condition either 'READY' or error type
         """
 
-        print("Status: ", end='')
-        if self.status == Reg.TFL_READY:
-            print("READY", end='')
-        elif self.status == Reg.TFL_SERIAL:
-            print("SERIAL", end='')
-        elif self.status == Reg.TFL_HEADER:
-            print("HEADER", end='')
-        elif self.status == Reg.TFL_CHECKSUM:
-            print("CHECKSUM", end='')
-        elif self.status == Reg.TFL_TIMEOUT:
-            print("TIMEOUT", end='')
-        elif self.status == Reg.TFL_PASS:
-            print("PASS", end='')
-        elif self.status == Reg.TFL_FAIL:
-            print("FAIL", end='')
-        elif self.status == Reg.TFL_I2CREAD:
-            print("I2C-READ", end='')
-        elif self.status == Reg.TFL_I2CWRITE:
-            print("I2C-WRITE", end='')
-        elif self.status == Reg.TFL_I2CLENGTH:
-            print("I2C-LENGTH", end='')
-        elif self.status == Reg.TFL_WEAK:
-            print("Signal weak", end='')
-        elif self.status == Reg.TFL_STRONG:
-            print("Signal saturation", end='')
-        elif self.status == Reg.TFL_FLOOD:
-            print("Ambient light saturation", end='')
-        else:
-            print("OTHER", end='')
-        print()
+        print("Status:", _STATUS_STR.get(self.status, "OTHER"))
+
+
+def enable_realtime(cpu=3, priority=50):
+    """
+    - - - - -   ENABLE REAL-TIME SCHEDULING   - - - - -
+    Move the calling process into the SCHED_FIFO class at
+    `priority`, pin it to a single `cpu` and lock its memory
+    so a sampling loop is not delayed by the default
+    scheduler or by page faults.  Needs root privileges.
+    For best results also reserve that CPU by adding
+    `isolcpus=3 nohz_full=3` to '/boot/cmdline.txt'.
+    Raises `OSError` if any step is not permitted, after
+    putting the process back the way it was.
+    """
+    old_cpus = os.sched_getaffinity(0)
+    libc = ctypes.CDLL(None, use_errno=True)
+    #  Pin and lock first, and switch scheduler last, so a
+    #  failure never leaves the process at SCHED_FIFO.
+    #  An isolated CPU is not in the default affinity mask,
+    #  so let the kernel reject a CPU that does not exist.
+    os.sched_setaffinity(0, {cpu})
+    try:
+        if libc.mlockall(_MCL_CURRENT | _MCL_FUTURE) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO,
+                                  os.sched_param(priority))
+        except OSError:
+            libc.munlockall()
+            raise
+    except OSError:
+        os.sched_setaffinity(0, old_cpus)
+        raise
 
 
 # If this module is executed by itself
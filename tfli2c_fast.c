@@ -0,0 +1,194 @@
+/*
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package: tfli2c_fast
+ # Described: Optional C extension for the `tfli2c` module.
+ #            Triggers the TF-Luna, reads its six-byte data
+ #            frame and decodes it in a single I2C_RDWR ioctl
+ #            with no Python `smbus2` objects in the path.
+ #
+ #  Sampler( port, addr)
+ #  opens '/dev/i2c-<port>' once and builds the trigger,
+ #  register-pointer and read messages for device `addr`
+ #
+ #  Sampler.read()
+ #  returns a `(dist, flux, temp)` tuple, temp in degrees C
+ #
+ #  Sampler.close()
+ #  closes the I2C device file
+ #
+ #  Build on the Raspberry Pi next to 'tfli2c.py' with:
+ #    gcc -O2 -shared -fPIC $(python3-config --includes) \
+ #        tfli2c_fast.c -o tfli2c_fast$(python3-config --extension-suffix)
+ #
+ #  `tfli2c.Lidar` uses this module when it can be imported
+ #  and falls back to pure Python otherwise.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+*/
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <errno.h>
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <unistd.h>
+#include <sys/ioctl.h>
+#include <linux/i2c.h>
+#include <linux/i2c-dev.h>
+
+#define TFL_DIST_LO 0x00
+#define TFL_TRIGGER 0x24
+
+typedef struct {
+    PyObject_HEAD
+    int fd;
+    uint8_t trigger[2];
+    uint8_t point[1];
+    uint8_t frame[6];
+    struct i2c_msg msgs[3];
+    struct i2c_rdwr_ioctl_data data;
+} SamplerObject;
+
+static int
+Sampler_init(SamplerObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"port", "addr", NULL};
+    int port, addr;
+    char path[32];
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "ii", kwlist, &port, &addr))
+        return -1;
+
+    if (self->fd >= 0)
+        close(self->fd);
+    snprintf(path, sizeof(path), "/dev/i2c-%d", port);
+    self->fd = open(path, O_RDWR);
+    if (self->fd < 0) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+        return -1;
+    }
+
+    /* Trigger a one-shot sample, point back at the first register
+       and read six bytes, joined by repeated-STARTs */
+    self->trigger[0] = TFL_TRIGGER;
+    self->trigger[1] = 1;
+    self->point[0] = TFL_DIST_LO;
+
+    self->msgs[0].addr = addr;
+    self->msgs[0].flags = 0;
+    self->msgs[0].len = sizeof(self->trigger);
+    self->msgs[0].buf = self->trigger;
+
+    self->msgs[1].addr = addr;
+    self->msgs[1].flags = 0;
+    self->msgs[1].len = sizeof(self->point);
+    self->msgs[1].buf = self->point;
+
+    self->msgs[2].addr = addr;
+    self->msgs[2].flags = I2C_M_RD;
+    self->msgs[2].len = sizeof(self->frame);
+    self->msgs[2].buf = self->frame;
+
+    self->data.msgs = self->msgs;
+    self->data.nmsgs = 3;
+    return 0;
+}
+
+static PyObject *
+Sampler_new(PyTypeObject *type, PyObject *Py_UNUSED(args),
+            PyObject *Py_UNUSED(kwds))
+{
+    SamplerObject *self = (SamplerObject *)type->tp_alloc(type, 0);
+    if (self != NULL)
+        self->fd = -1;
+    return (PyObject *)self;
+}
+
+static void
+Sampler_dealloc(SamplerObject *self)
+{
+    if (self->fd >= 0)
+        close(self->fd);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *
+Sampler_read(SamplerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    int rc;
+    const uint8_t *f = self->frame;
+
+    if (self->fd < 0) {
+        PyErr_SetString(PyExc_ValueError, "I/O operation on closed sampler");
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    rc = ioctl(self->fd, I2C_RDWR, &self->data);
+    Py_END_ALLOW_THREADS
+    if (rc < 0)
+        return PyErr_SetFromErrno(PyExc_OSError);
+
+    /* Three little-endian unsigned words: dist, flux, temp */
+    return Py_BuildValue("iid",
+                         f[0] | (f[1] << 8),
+                         f[2] | (f[3] << 8),
+                         (f[4] | (f[5] << 8)) / 100.0);
+}
+
+static PyObject *
+Sampler_close(SamplerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    if (self->fd >= 0) {
+        close(self->fd);
+        self->fd = -1;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef Sampler_methods[] = {
+    {"read", (PyCFunction)Sampler_read, METH_NOARGS,
+     "Trigger and read one sample, return (dist, flux, temp)"},
+    {"close", (PyCFunction)Sampler_close, METH_NOARGS,
+     "Close the I2C device file"},
+    {NULL}
+};
+
+static PyTypeObject SamplerType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "tfli2c_fast.Sampler",
+    .tp_doc = "Sampler(port, addr): TF-Luna trigger-and-read in one ioctl",
+    .tp_basicsize = sizeof(SamplerObject),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = Sampler_new,
+    .tp_init = (initproc)Sampler_init,
+    .tp_dealloc = (destructor)Sampler_dealloc,
+    .tp_methods = Sampler_methods,
+};
+
+static struct PyModuleDef tfli2c_fast_module = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "tfli2c_fast",
+    .m_doc = "Optional C fast path for the tfli2c TF-Luna module.",
+    .m_size = -1,
+};
+
+PyMODINIT_FUNC
+PyInit_tfli2c_fast(void)
+{
+    PyObject *m;
+
+    if (PyType_Ready(&SamplerType) < 0)
+        return NULL;
+    m = PyModule_Create(&tfli2c_fast_module);
+    if (m == NULL)
+        return NULL;
+    Py_INCREF(&SamplerType);
+    if (PyModule_AddObject(m, "Sampler", (PyObject *)&SamplerType) < 0) {
+        Py_DECREF(&SamplerType);
+        Py_DECREF(m);
+        return NULL;
+    }
+    return m;
+}